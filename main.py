@@ -10,7 +10,7 @@ import time
 class LaneDetection:
     """Class for running the lane detection algorithm."""
 
-    def __init__(self, frame: FrameDB = FrameDB(), prepoc: Preproc = Preproc(), featext: FeatExtract = FeatExtract(), visualizer: Visualizer = Visualizer()):
+    def __init__(self, frame: FrameDB = FrameDB(), prepoc: Preproc = Preproc(), featext: FeatExtract = FeatExtract(), visualizer: Visualizer = Visualizer(), adaptive_yellow: bool = False):
         """Initializing input classes.
 
         Args:
@@ -18,18 +18,32 @@ class LaneDetection:
             prepoc (Preproc): Class for image processing methods.
             featext (FeatExtract): Class for feature extraction.
             visualizer (Visualizer): Class for visualizing results.
+            adaptive_yellow (bool, optional): Runs the yellow lane pass only when enough yellow pixels are present or periodically. (True = ON)
         """
         self.frame = frame
         self.prepoc = prepoc
         self.featext = featext
         self.visualizer = visualizer
+        self.adaptive_yellow = adaptive_yellow
 
         self.mod_frame_array = []
         self.left_poly = [0, 0]
         self.right_poly = [0, 0]
         self.yellow_lanes_flag = False
+        self.sides_ok = [False, False]
+        self.direction = None
+        self.original = None
+        self.combined_lanes_binary = None
+        self.birdview_points = None
+        self.histogram = None
         self.prev_time = 1
 
+        # State and statistics of the adaptive yellow pass scheduling
+        self.yellow_gate_open = False
+        self.frame_count = 0
+        self.yellow_pass_runs = 0
+        self.yellow_pass_skips = 0
+
         # Constants for preprocessing
         # Color space transform constants [Hue (0-180), Lightness (0-255), Saturation (0-255)]
         self.LOWER_YELLOW = np.array([15, 80, 100])
@@ -55,6 +69,133 @@ class LaneDetection:
         self.WINDOW_HOR_OFFSET = 25
         self.MINPIX = 1
 
+        # Constants for the adaptive yellow pass scheduling
+        # Number of yellow mask pixels in the ROI opening and closing the yellow pass (hysteresis: ON > OFF)
+        # Found yellow lanes also keep the pass running until they are lost
+        self.YELLOW_PIXELS_ON = 500
+        self.YELLOW_PIXELS_OFF = 200
+        # The yellow pass runs on every Nth frame regardless of the yellow pixel count
+        self.YELLOW_CHECK_PERIOD = 10
+
+    def schedule_yellow_pass(self, yellow_lanes_binary: np.ndarray) -> bool:
+        """Decides whether the yellow lane pass has to run on the current frame based on the number of yellow mask pixels.
+
+        Args:
+            yellow_lanes_binary (np.ndarray): Frame with kept yellow colors returned by colorspace_transform.
+
+        Returns:
+            run_yellow_pass (bool): Flag for running the yellow lane pass. (True = run)
+        """
+        if not self.adaptive_yellow:
+            return True
+
+        # Yellow pixels always have a non-zero red channel, so counting it is enough
+        yellow_pixels = cv.countNonZero(cv.extractChannel(yellow_lanes_binary, 2))
+        # The gate stays open while the previous yellow lane search found the lanes, even at low pixel counts
+        if self.yellow_gate_open and yellow_pixels < self.YELLOW_PIXELS_OFF and not self.yellow_lanes_flag:
+            self.yellow_gate_open = False
+        elif not self.yellow_gate_open and (yellow_pixels >= self.YELLOW_PIXELS_ON or self.yellow_lanes_flag):
+            self.yellow_gate_open = True
+
+        run_yellow_pass = self.yellow_gate_open or self.frame_count % self.YELLOW_CHECK_PERIOD == 0
+        self.frame_count += 1
+        if run_yellow_pass:
+            self.yellow_pass_runs += 1
+        else:
+            self.yellow_pass_skips += 1
+        return run_yellow_pass
+
+    def yellow_skip_ratio(self) -> float:
+        """Proportion of the frames on which the yellow lane pass was skipped by the adaptive scheduling.
+
+        Returns:
+            float: Skipped yellow passes / processed frames.
+        """
+        total = self.yellow_pass_runs + self.yellow_pass_skips
+        return self.yellow_pass_skips / total if total else 0
+
+    def process_frame(self, imp_frame: np.ndarray, sliding_windows_debug: bool = False) -> tuple[int, np.ndarray]:
+        """Runs the preprocessing and feature extraction steps on a single imported frame.
+        The detection state (polynomials, sides_ok, yellow lanes flag) is kept on the instance between frames.
+
+        Args:
+            imp_frame (np.ndarray): Imported frame.
+            sliding_windows_debug (bool, optional): Flag for the window debugging mode. (True = ON)
+
+        Returns:
+            direction (int): Direction of the vehile from the lanes middle line. (0: in the middle, 1: vehicle is to the right side, -1: vehicle is to the left side)
+            original (np.ndarray): Output frame with the indicated lanes transformed back into original POV.
+        """
+        # Outputs of the previous frame are kept if no lane detection took place on this one
+        direction = self.direction
+        original = self.original
+
+        # Preprocessing
+        downscaled = self.prepoc.downscale(
+            imp_frame, self.DOWNSCALE_TARGET_RES)
+        downscaled_cropped, disc = self.prepoc.extract_roi(
+            downscaled, self.CROP_VERT_START, self.CROP_HOR_START)
+        self.combined_lanes_binary, yellow_lanes_binary = self.prepoc.colorspace_transform(
+            downscaled_cropped, self.LOWER_YELLOW, self.UPPER_YELLOW, self.LOWER_WHITE, self.UPPER_WHITE)
+
+        # Without a yellow pass the combined lanes are followed
+        run_yellow_pass = self.schedule_yellow_pass(yellow_lanes_binary)
+        if not run_yellow_pass:
+            self.yellow_lanes_flag = False
+
+        # White AND yellow preprocessing and lane detection
+        if not self.yellow_lanes_flag:
+            birdseye_binary, Minv, self.birdview_points = self.prepoc.birdseye_transform(
+                self.combined_lanes_binary, self.PERS_TRANS_LEFTUPPER, self.PERS_TRANS_RIGHTUPPER, self.PERS_TRANS_LEFTLOWER, self.PERS_TRANS_RIGHTLOWER)
+            sobel_binary = self.prepoc.make_binary(
+                birdseye_binary, self.SOBEL_THRESH_LOW)
+            opened = self.prepoc.opening(sobel_binary)
+            self.histogram = self.featext.make_histogram(
+                opened, self.HISTOGRAM_ROI_PROP)
+            left, right, nwindow_ok, self.yellow_lanes_flag = self.featext.lane_search(
+                opened, self.histogram, "combined", self.NWINDOWS, self.WINDOW_HOR_OFFSET, self.MINPIX, window_debug=sliding_windows_debug)
+            self.left_poly, self.right_poly = self.featext.poly_fit(
+                left, right, self.left_poly, self.right_poly, nwindow_ok)
+            self.sides_ok = nwindow_ok
+            direction, original = self.featext.draw_lane_lines(
+                downscaled_cropped, sobel_binary, Minv, disc, self.left_poly, self.right_poly)
+
+            if sliding_windows_debug:
+                # self.visualizer.render_cv(birdseye_binary, 'Bird')
+                # self.visualizer.render_cv(sobel_binary, 'Sobel')
+                self.visualizer.render_cv(
+                    opened, 'Sliding windows debugging')
+
+        # Only yellow preprocessing and lane detection
+        if run_yellow_pass:
+            birdseye_binary_yellow, Minv, self.birdview_points = self.prepoc.birdseye_transform(
+                yellow_lanes_binary, self.PERS_TRANS_LEFTUPPER, self.PERS_TRANS_RIGHTUPPER, self.PERS_TRANS_LEFTLOWER, self.PERS_TRANS_RIGHTLOWER)
+            sobel_binary_yellow = self.prepoc.make_binary(
+                birdseye_binary_yellow, self.SOBEL_THRESH_LOW)
+            opened_yellow = self.prepoc.opening(sobel_binary_yellow)
+            histogram_yellow = self.featext.make_histogram(
+                opened_yellow, self.HISTOGRAM_ROI_PROP)
+            left, right, nwindow_ok, self.yellow_lanes_flag = self.featext.lane_search(
+                opened_yellow, histogram_yellow, "yellow", self.NWINDOWS, self.WINDOW_HOR_OFFSET, self.MINPIX, window_debug=sliding_windows_debug)
+
+            # If yellow lanes have been found on both sides of the vehicle
+            if self.yellow_lanes_flag:
+                self.left_poly, self.right_poly = self.featext.poly_fit(
+                    left, right, self.left_poly, self.right_poly, nwindow_ok)
+                self.sides_ok = nwindow_ok
+                direction, original = self.featext.draw_lane_lines(
+                    downscaled_cropped, sobel_binary_yellow, Minv, disc, self.left_poly, self.right_poly)
+
+                if sliding_windows_debug:
+                    # self.visualizer.render_cv(birdseye_binary_yellow, 'Bird')
+                    # self.visualizer.render_cv(sobel_binary_yellow, 'Sobel')
+                    self.visualizer.render_cv(
+                        opened_yellow, 'Sliding windows debugging')
+
+        self.direction = direction
+        self.original = original
+        return direction, original
+
     def run(self, birdseye_view__points_debug: bool = False, histogram_debug: bool = False, sliding_windows_debug: bool = False, save_result: bool = False) -> None:
         while (self.frame.streaming):
             try:
@@ -66,61 +207,9 @@ class LaneDetection:
                 # Image acquisition
                 self.streaming, imp_frame = self.frame.import_frame()
 
-                # Preprocessing
-                downscaled = self.prepoc.downscale(
-                    imp_frame, self.DOWNSCALE_TARGET_RES)
-                downscaled_cropped, disc = self.prepoc.extract_roi(
-                    downscaled, self.CROP_VERT_START, self.CROP_HOR_START)
-                combined_lanes_binary, yellow_lanes_binary = self.prepoc.colorspace_transform(
-                    downscaled_cropped, self.LOWER_YELLOW, self.UPPER_YELLOW, self.LOWER_WHITE, self.UPPER_WHITE)
-
-                # White AND yellow preprocessing and lane detection
-                if not self.yellow_lanes_flag:
-                    birdseye_binary, Minv, birdview_points = self.prepoc.birdseye_transform(
-                        combined_lanes_binary, self.PERS_TRANS_LEFTUPPER, self.PERS_TRANS_RIGHTUPPER, self.PERS_TRANS_LEFTLOWER, self.PERS_TRANS_RIGHTLOWER)
-                    sobel_binary = self.prepoc.make_binary(
-                        birdseye_binary, self.SOBEL_THRESH_LOW)
-                    opened = self.prepoc.opening(sobel_binary)
-                    histogram = self.featext.make_histogram(
-                        opened, self.HISTOGRAM_ROI_PROP)
-                    left, right, nwindow_ok, self.yellow_lanes_flag = self.featext.lane_search(
-                        opened, histogram, "combined", self.NWINDOWS, self.WINDOW_HOR_OFFSET, self.MINPIX, window_debug=sliding_windows_debug)
-                    self.left_poly, self.right_poly = self.featext.poly_fit(
-                        left, right, self.left_poly, self.right_poly, nwindow_ok)
-                    direction, original = self.featext.draw_lane_lines(
-                        downscaled_cropped, sobel_binary, Minv, disc, self.left_poly, self.right_poly)
-
-                    if sliding_windows_debug:
-                        # self.visualizer.render_cv(birdseye_binary, 'Bird')
-                        # self.visualizer.render_cv(sobel_binary, 'Sobel')
-                        self.visualizer.render_cv(
-                            opened, 'Sliding windows debugging')
-
-                # Only yellow preprocessing and lane detection
-                birdseye_binary_yellow, Minv, birdview_points = self.prepoc.birdseye_transform(
-                    yellow_lanes_binary, self.PERS_TRANS_LEFTUPPER, self.PERS_TRANS_RIGHTUPPER, self.PERS_TRANS_LEFTLOWER, self.PERS_TRANS_RIGHTLOWER)
-                sobel_binary_yellow = self.prepoc.make_binary(
-                    birdseye_binary_yellow, self.SOBEL_THRESH_LOW)
-                opened_yellow = self.prepoc.opening(sobel_binary_yellow)
-                histogram_yellow = self.featext.make_histogram(
-                    opened_yellow, self.HISTOGRAM_ROI_PROP)
-                left, right, nwindow_ok, self.yellow_lanes_flag = self.featext.lane_search(
-                    opened_yellow, histogram_yellow, "yellow", self.NWINDOWS, self.WINDOW_HOR_OFFSET, self.MINPIX, window_debug=sliding_windows_debug)
-
-                # If yellow lanes have been found on both sides of the vehicle
-                if self.yellow_lanes_flag:
-                    self.left_poly, self.right_poly = self.featext.poly_fit(
-                        left, right, self.left_poly, self.right_poly, nwindow_ok)
-                    direction_yellow, original_yellow = self.featext.draw_lane_lines(
-                        downscaled_cropped, sobel_binary_yellow, Minv, disc, self.left_poly, self.right_poly)
-                    direction = direction_yellow
-                    original = original_yellow
-
-                    if sliding_windows_debug:
-                        # self.visualizer.render_cv(birdseye_binary_yellow, 'Bird')
-                        # self.visualizer.render_cv(sobel_binary_yellow, 'Sobel')
-                        self.visualizer.render_cv(
-                            opened_yellow, 'Sliding windows debugging')
+                # Preprocessing and feature extraction
+                direction, original = self.process_frame(
+                    imp_frame, sliding_windows_debug)
 
                 # Final output frame notation and visualization
                 final = self.visualizer.write_text(
@@ -131,10 +220,10 @@ class LaneDetection:
                     self.mod_frame_array = self.frame.reconsturct_store(final)
                 if birdseye_view__points_debug:
                     self.visualizer.plot_birdview(
-                        combined_lanes_binary, birdview_points)
+                        self.combined_lanes_binary, self.birdview_points)
                 if histogram_debug:
                     if cv.waitKey(10) == ord('h'):
-                        self.visualizer.plot_histogram(histogram)
+                        self.visualizer.plot_histogram(self.histogram)
                 if cv.waitKey(10) == ord('q'):
                     break
             except Exception as error:
@@ -149,6 +238,8 @@ class LaneDetection:
             self.frame.save_to_database(self.mod_frame_array)
         self.frame.cap.release()
         cv.destroyAllWindows()
+        if self.adaptive_yellow:
+            print(f"Yellow lane pass skipped on {self.yellow_pass_skips} of {self.yellow_pass_runs + self.yellow_pass_skips} frames ({self.yellow_skip_ratio():.0%})")
 
 
 def main():
@@ -158,8 +249,9 @@ def main():
     # histogram_debug: While enabled, by pressing the 'h' key, the user can see the given binary frame's histogram
     # sliding_windows_debug: Lets the user inspect the workings of the sliding windows technique
     # save_result: saves the output video with the detected lanes into a new folder (Can take longer)
+    # adaptive_yellow: runs the yellow lane pass only when enough yellow pixels are present or on every Nth frame (faster)
     lane_detector = LaneDetection(frame=FrameDB(
-        'example_material\\example_video.mp4'), prepoc=Preproc(mode = 0), featext=FeatExtract(), visualizer=Visualizer())
+        'example_material\\example_video.mp4'), prepoc=Preproc(mode = 0), featext=FeatExtract(), visualizer=Visualizer(), adaptive_yellow=False)
     lane_detector.run(birdseye_view__points_debug=False,
                       histogram_debug=True, sliding_windows_debug=True, save_result=False)
 
@@ -0,0 +1,469 @@
+from frame import FrameDB
+from preproc import Preproc
+from visualizer import Visualizer
+from feat_ext import FeatExtract
+from main import LaneDetection
+from regression import throughput
+from multiprocessing import shared_memory
+import multiprocessing as mp
+import queue
+import threading
+import cv2 as cv
+import numpy as np
+import os
+from os import path
+import time
+
+
+class FrameRing:
+    """Fixed-slot ring buffer in shared memory for passing frames between processes without copying them."""
+
+    def __init__(self, ctx, nslots: int, fields: list[tuple[tuple, np.dtype]]) -> None:
+        """Allocating the shared memory and the slot semaphores.
+
+        Args:
+            ctx: Multiprocessing context the stage processes are started with.
+            nslots (int): Number of slots in the ring.
+            fields (list[tuple[tuple, np.dtype]]): Shape and type of every array stored in a slot.
+        """
+        self.nslots = nslots
+        self.fields = [(tuple(shape), np.dtype(dtype)) for shape, dtype in fields]
+        self.slot_nbytes = sum(int(np.prod(shape)) * dtype.itemsize for shape, dtype in self.fields)
+        self.shm = shared_memory.SharedMemory(create=True, size=self.slot_nbytes * nslots)
+        self.name = self.shm.name
+        # Frame idx is always stored in slot idx % nslots, its semaphore is released when the slot can be overwritten
+        self.free = [ctx.Semaphore(1) for _ in range(nslots)]
+        self.in_use = ctx.Value('i', 0)
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state['shm']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        # Child processes started with spawn attach to the already existing shared memory
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=self.name)
+
+    def slot(self, idx: int) -> list[np.ndarray]:
+        """Gives the arrays of the slot of the given frame, backed by the shared memory.
+
+        Args:
+            idx (int): Frame index.
+
+        Returns:
+            arrays (list[np.ndarray]): Views of the slot, one for every field.
+        """
+        offset = (idx % self.nslots) * self.slot_nbytes
+        arrays = []
+        for shape, dtype in self.fields:
+            arrays.append(np.ndarray(shape, dtype, buffer=self.shm.buf, offset=offset))
+            offset += int(np.prod(shape)) * dtype.itemsize
+        return arrays
+
+    def acquire(self, idx: int) -> int:
+        """Waits until the slot of the given frame can be written (backpressure).
+
+        Args:
+            idx (int): Frame index.
+
+        Returns:
+            in_use (int): Number of occupied slots including the acquired one.
+        """
+        self.free[idx % self.nslots].acquire()
+        with self.in_use.get_lock():
+            self.in_use.value += 1
+            return self.in_use.value
+
+    def release(self, idx: int) -> None:
+        """Marks the slot of the given frame as free after its consumer is done with it.
+
+        Args:
+            idx (int): Frame index.
+        """
+        with self.in_use.get_lock():
+            self.in_use.value -= 1
+        self.free[idx % self.nslots].release()
+
+    def close(self, unlink: bool = False) -> None:
+        """Detaches from the shared memory and frees it if requested (only by its creator).
+
+        Args:
+            unlink (bool, optional): Frees the shared memory. Defaults to False.
+        """
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class StageStats:
+    """Class for measuring where a stage process spends its time."""
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.frames = 0
+        self.busy = 0
+        self.wait_in = 0
+        self.wait_out = 0
+        self.ring_fill = 0
+        self.mark = time.perf_counter()
+
+    def lap(self) -> float:
+        """Returns the time elapsed since the previous lap."""
+        now = time.perf_counter()
+        elapsed = now - self.mark
+        self.mark = now
+        return elapsed
+
+    def report(self) -> dict:
+        """Summarizes the measured times.
+
+        Returns:
+            report (dict): Processed frames, occupancy (busy time / total time), time spent waiting for input and for free slots [s], mean number of occupied slots of the output ring.
+        """
+        total = self.busy + self.wait_in + self.wait_out
+        return {'frames': self.frames, 'occupancy': self.busy / total if total else 0, 'wait_in': self.wait_in,
+                'wait_out': self.wait_out, 'ring_fill': self.ring_fill / self.frames if self.frames else 0}
+
+
+def preprocess(config: dict, prepoc: Preproc, imp_frame: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Runs the preprocessing of both the combined and the yellow lanes on a frame.
+    Unlike LaneDetection.process_frame, both passes always run as the yellow lanes flag of the previous frame is not known yet.
+
+    Args:
+        config (dict): Constants of the lane detection. (LaneDetection attributes in upper case)
+        prepoc (Preproc): Class for image processing methods.
+        imp_frame (np.ndarray): Imported frame.
+
+    Returns:
+        downscaled (np.ndarray): Downscaled frame.
+        opened (np.ndarray): Opened binary frame of the combined lanes.
+        opened_yellow (np.ndarray): Opened binary frame of the yellow lanes.
+    """
+    downscaled = prepoc.downscale(imp_frame, config['DOWNSCALE_TARGET_RES'])
+    downscaled_cropped, disc = prepoc.extract_roi(downscaled, config['CROP_VERT_START'], config['CROP_HOR_START'])
+    combined_lanes_binary, yellow_lanes_binary = prepoc.colorspace_transform(
+        downscaled_cropped, config['LOWER_YELLOW'], config['UPPER_YELLOW'], config['LOWER_WHITE'], config['UPPER_WHITE'])
+
+    opened_binaries = []
+    for lanes_binary in (combined_lanes_binary, yellow_lanes_binary):
+        birdseye_binary, Minv, birdview_points = prepoc.birdseye_transform(
+            lanes_binary, config['PERS_TRANS_LEFTUPPER'], config['PERS_TRANS_RIGHTUPPER'], config['PERS_TRANS_LEFTLOWER'], config['PERS_TRANS_RIGHTLOWER'])
+        sobel_binary = prepoc.make_binary(birdseye_binary, config['SOBEL_THRESH_LOW'])
+        opened_binaries.append(prepoc.opening(sobel_binary))
+    return downscaled, opened_binaries[0], opened_binaries[1]
+
+
+def decode_stage(source, frame_ring: FrameRing, out_queue, results, preproc_workers: int, detach: bool = True) -> None:
+    """Stage reading the frames of the source into the frame ring.
+    Runs in its own process for video files and in a thread of the main process for in-memory frames.
+
+    Args:
+        source (str | list[np.ndarray]): Location of the video file or the frames themselves.
+        frame_ring (FrameRing): Ring of the imported frames.
+        out_queue (mp.Queue): Indices of the imported frames for the preprocessing stage.
+        results (mp.Queue): Queue for the stage statistics.
+        preproc_workers (int): Number of preprocessing processes to signal the end of the stream to.
+        detach (bool, optional): Detaches from the frame ring at the end, only in a separate process. Defaults to True.
+    """
+    stats = StageStats('decode')
+    frame_db = FrameDB(source) if isinstance(source, str) else None
+    idx = 0
+    while frame_db is not None or idx < len(source):
+        ring_fill = frame_ring.acquire(idx)
+        stats.wait_out += stats.lap()
+        frame_slot, = frame_ring.slot(idx)
+        if frame_db is None:
+            np.copyto(frame_slot, source[idx])
+        else:
+            # The decoder writes straight into the slot if the frame size matches
+            ret, base = frame_db.cap.read(frame_slot)
+            if not ret:
+                frame_ring.release(idx)
+                break
+            if not np.shares_memory(base, frame_slot):
+                np.copyto(frame_slot, base)
+        out_queue.put(idx)
+        stats.frames += 1
+        stats.ring_fill += ring_fill
+        stats.busy += stats.lap()
+        idx += 1
+    if frame_db is not None:
+        frame_db.cap.release()
+    for worker in range(preproc_workers):
+        out_queue.put(None)
+    if detach:
+        frame_ring.close()
+    results.put(('stats', stats.name, stats.report()))
+
+
+def preproc_stage(config: dict, prepoc: Preproc, frame_ring: FrameRing, feature_ring: FrameRing, in_queue, out_queue, results, worker: int) -> None:
+    """Stage process running the preprocessing of the imported frames into the feature ring.
+
+    Args:
+        config (dict): Constants of the lane detection. (LaneDetection attributes in upper case)
+        prepoc (Preproc): Class for image processing methods.
+        frame_ring (FrameRing): Ring of the imported frames.
+        feature_ring (FrameRing): Ring of the preprocessed frames.
+        in_queue (mp.Queue): Indices of the imported frames.
+        out_queue (mp.Queue): Indices of the preprocessed frames for the feature extraction stage.
+        results (mp.Queue): Queue for the stage statistics.
+        worker (int): Index of the preprocessing process.
+    """
+    stats = StageStats(f'preproc_{worker}')
+    while True:
+        idx = in_queue.get()
+        stats.wait_in += stats.lap()
+        if idx is None:
+            break
+        frame_slot, = frame_ring.slot(idx)
+        downscaled, opened, opened_yellow = preprocess(config, prepoc, frame_slot)
+        stats.busy += stats.lap()
+
+        # The frame slot is only released once the feature slot is owned, otherwise a frame one ring length
+        # later could be decoded into it and take the feature slot first, which deadlocks the in-order stages
+        stats.ring_fill += feature_ring.acquire(idx)
+        frame_ring.release(idx)
+        stats.wait_out += stats.lap()
+        for field, array in zip(feature_ring.slot(idx), (downscaled, opened, opened_yellow)):
+            np.copyto(field, array)
+        out_queue.put(idx)
+        stats.frames += 1
+        stats.busy += stats.lap()
+    out_queue.put(None)
+    frame_ring.close()
+    feature_ring.close()
+    results.put(('stats', stats.name, stats.report()))
+
+
+def featext_stage(config: dict, featext: FeatExtract, feature_ring: FrameRing, in_queue, out_queue, results, preproc_workers: int) -> None:
+    """Stage process searching the lanes and fitting the polynomials on the preprocessed frames in order.
+
+    Args:
+        config (dict): Constants of the lane detection. (LaneDetection attributes in upper case)
+        featext (FeatExtract): Class for feature extraction.
+        feature_ring (FrameRing): Ring of the preprocessed frames.
+        in_queue (mp.Queue): Indices of the preprocessed frames, can arrive out of order from multiple preprocessing processes.
+        out_queue (mp.Queue): Per-frame detection results for the rendering stage.
+        results (mp.Queue): Queue for the stage statistics.
+        preproc_workers (int): Number of preprocessing processes to wait for the end of the stream from.
+    """
+    stats = StageStats('featext')
+    left_poly, right_poly = [0, 0], [0, 0]
+    sides_ok = [False, False]
+    yellow_lanes_flag = False
+    pending = set()
+    next_idx = 0
+    finished = 0
+    while finished < preproc_workers:
+        idx = in_queue.get()
+        stats.wait_in += stats.lap()
+        if idx is None:
+            finished += 1
+            continue
+        pending.add(idx)
+
+        # Frames are processed in order as the polynomials and the yellow lanes flag carry over between frames
+        while next_idx in pending:
+            pending.remove(next_idx)
+            downscaled, opened, opened_yellow = feature_ring.slot(next_idx)
+            drawn = False
+            if not yellow_lanes_flag:
+                histogram = featext.make_histogram(opened, config['HISTOGRAM_ROI_PROP'])
+                left, right, nwindow_ok, yellow_lanes_flag = featext.lane_search(
+                    opened, histogram, "combined", config['NWINDOWS'], config['WINDOW_HOR_OFFSET'], config['MINPIX'])
+                left_poly, right_poly = featext.poly_fit(left, right, left_poly, right_poly, nwindow_ok)
+                sides_ok = nwindow_ok
+                drawn = True
+
+            histogram_yellow = featext.make_histogram(opened_yellow, config['HISTOGRAM_ROI_PROP'])
+            left, right, nwindow_ok, yellow_lanes_flag = featext.lane_search(
+                opened_yellow, histogram_yellow, "yellow", config['NWINDOWS'], config['WINDOW_HOR_OFFSET'], config['MINPIX'])
+            if yellow_lanes_flag:
+                left_poly, right_poly = featext.poly_fit(left, right, left_poly, right_poly, nwindow_ok)
+                sides_ok = nwindow_ok
+                drawn = True
+
+            out_queue.put((next_idx, left_poly, right_poly, sides_ok, yellow_lanes_flag, drawn))
+            stats.frames += 1
+            next_idx += 1
+        stats.busy += stats.lap()
+    out_queue.put(None)
+    feature_ring.close()
+    results.put(('stats', stats.name, stats.report()))
+
+
+def render_stage(config: dict, prepoc: Preproc, featext: FeatExtract, visualizer: Visualizer, feature_ring: FrameRing, in_queue, results, output_path: str) -> None:
+    """Stage process drawing the detected lanes, writing the messages and encoding the output video.
+
+    Args:
+        config (dict): Constants of the lane detection. (LaneDetection attributes in upper case)
+        prepoc (Preproc): Class for image processing methods.
+        featext (FeatExtract): Class for feature extraction.
+        visualizer (Visualizer): Class for visualizing results.
+        feature_ring (FrameRing): Ring of the preprocessed frames.
+        in_queue (mp.Queue): Per-frame detection results in order.
+        results (mp.Queue): Queue for the per-frame outputs and the stage statistics.
+        output_path (str): Location of the output video, no video is written if empty.
+    """
+    stats = StageStats('render')
+    # The inverse perspective matrix only depends on the frame size, so it is computed once
+    downscaled, opened, opened_yellow = feature_ring.slot(0)
+    birdseye_binary, Minv, birdview_points = prepoc.birdseye_transform(
+        np.zeros_like(opened), config['PERS_TRANS_LEFTUPPER'], config['PERS_TRANS_RIGHTUPPER'], config['PERS_TRANS_LEFTLOWER'], config['PERS_TRANS_RIGHTLOWER'])
+    writer = None
+    direction, original = None, None
+    prev_time = time.time()
+    while True:
+        message = in_queue.get()
+        stats.wait_in += stats.lap()
+        if message is None:
+            break
+        idx, left_poly, right_poly, sides_ok, yellow_lanes_flag, drawn = message
+        downscaled, opened, opened_yellow = feature_ring.slot(idx)
+
+        # Outputs of the previous frame are kept if no lane detection took place on this one
+        if drawn:
+            downscaled_cropped, disc = prepoc.extract_roi(downscaled, config['CROP_VERT_START'], config['CROP_HOR_START'])
+            direction, original = featext.draw_lane_lines(downscaled_cropped, opened, Minv, disc, left_poly, right_poly)
+        feature_ring.release(idx)
+
+        current_time = time.time()
+        fps = int(1/max(current_time-prev_time, 1e-6))
+        prev_time = current_time
+        final = visualizer.write_text(original, direction, yellow_lanes_flag, fps)
+        if output_path:
+            if writer is None:
+                height, width = final.shape[:2]
+                writer = cv.VideoWriter(output_path, cv.VideoWriter_fourcc(*'XVID'), 24.0, (width, height))
+            writer.write(final)
+        results.put(('frame', (idx, left_poly, right_poly, direction, sides_ok, yellow_lanes_flag)))
+        stats.frames += 1
+        stats.busy += stats.lap()
+    if writer is not None:
+        writer.release()
+    feature_ring.close()
+    results.put(('stats', stats.name, stats.report()))
+
+
+class StagePipeline:
+    """Class for running the lane detection with its stages in separate processes connected by shared memory ring buffers.
+    The stages follow the reference scheduling of LaneDetection.process_frame, lane detectors with adaptive_yellow enabled are rejected.
+    """
+
+    def __init__(self, lane_detector: LaneDetection, preproc_workers: int = 1) -> None:
+        """Initializing the stage configuration.
+
+        Args:
+            lane_detector (LaneDetection): Lane detector whose processing classes and constants the stages use.
+            preproc_workers (int, optional): Number of preprocessing processes. Defaults to 1.
+        """
+        if lane_detector.adaptive_yellow:
+            raise ValueError("The stage pipeline doesn't support the adaptive yellow lane pass scheduling.")
+        if preproc_workers < 1:
+            raise ValueError("The stage pipeline needs at least one preprocessing process.")
+        self.prepoc = lane_detector.prepoc
+        self.featext = lane_detector.featext
+        self.visualizer = lane_detector.visualizer
+        self.config = {key: value for key, value in vars(lane_detector).items() if key.isupper()}
+        self.preproc_workers = preproc_workers
+
+        # Number of slots of each ring buffer
+        self.NSLOTS = 8
+        # Interval of checking the stage processes for failures while waiting for results [s]
+        self.POLL_TIMEOUT = 1
+        # Number of first output frames left out of the throughput
+        self.WARMUP_FRAMES = 5
+
+    def run(self, source, output_path: str = '') -> tuple[list[tuple], dict]:
+        """Runs the lane detection on the whole source.
+
+        Args:
+            source (str | list[np.ndarray]): Location of the video file or the frames themselves.
+            output_path (str, optional): Location of the output video, no video is written if empty.
+
+        Returns:
+            records (list[tuple]): Per-frame outputs in order. (frame index, left polynomial, right polynomial, direction, sides_ok, yellow lanes flag)
+            report (dict): Throughput from the decoding to the rendering after the warm-up [frames/s] and the statistics of every stage.
+        """
+        if isinstance(source, str):
+            frame_db = FrameDB(source)
+            frame_shape = (int(frame_db.cap.get(cv.CAP_PROP_FRAME_HEIGHT)), int(frame_db.cap.get(cv.CAP_PROP_FRAME_WIDTH)), 3)
+            frame_db.cap.release()
+        else:
+            frame_shape = source[0].shape
+
+        # The layout of the feature ring is given by the preprocessing of an empty frame
+        ctx = mp.get_context()
+        probe = preprocess(self.config, self.prepoc, np.zeros(frame_shape, np.uint8))
+        frame_ring = FrameRing(ctx, self.NSLOTS, [(frame_shape, np.uint8)])
+        feature_ring = FrameRing(ctx, self.NSLOTS, [(array.shape, array.dtype) for array in probe])
+        decode_queue, preproc_queue, featext_queue, results = ctx.Queue(), ctx.Queue(), ctx.Queue(), ctx.Queue()
+
+        # In-memory frames are copied into the frame ring by a thread of this process instead of being pickled into a decoder process
+        decode_errors = []
+        if isinstance(source, str):
+            decoder = None
+            processes = [ctx.Process(target=decode_stage, args=(source, frame_ring, decode_queue, results, self.preproc_workers))]
+        else:
+            def decode_thread():
+                try:
+                    decode_stage(source, frame_ring, decode_queue, results, self.preproc_workers, detach=False)
+                except Exception as error:
+                    decode_errors.append(error)
+            decoder = threading.Thread(target=decode_thread, daemon=True)
+            processes = []
+        for worker in range(self.preproc_workers):
+            processes.append(ctx.Process(target=preproc_stage, args=(
+                self.config, self.prepoc, frame_ring, feature_ring, decode_queue, preproc_queue, results, worker)))
+        processes.append(ctx.Process(target=featext_stage, args=(
+            self.config, self.featext, feature_ring, preproc_queue, featext_queue, results, self.preproc_workers)))
+        processes.append(ctx.Process(target=render_stage, args=(
+            self.config, self.prepoc, self.featext, self.visualizer, feature_ring, featext_queue, results, output_path)))
+
+        records, arrival_times, stages = [], [], {}
+        try:
+            for process in processes:
+                process.start()
+            if decoder is not None:
+                decoder.start()
+            while len(stages) < len(processes) + (decoder is not None):
+                try:
+                    kind, *payload = results.get(timeout=self.POLL_TIMEOUT)
+                except queue.Empty:
+                    if decode_errors or any(process.exitcode not in (None, 0) for process in processes):
+                        raise RuntimeError("A lane detection stage process failed.")
+                    continue
+                if kind == 'frame':
+                    records.append(payload[0])
+                    arrival_times.append(time.perf_counter())
+                else:
+                    stages[payload[0]] = payload[1]
+            for process in processes:
+                process.join()
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+            frame_ring.close(unlink=True)
+            feature_ring.close(unlink=True)
+
+        return records, {'fps': throughput(arrival_times, self.WARMUP_FRAMES), 'stages': stages}
+
+
+def main():
+    # Running the lane detection with the stage processes on the example video and saving the result
+    # into the 'output' folder (detected_lanes_stages.avi) in the processing resolution, without the 4x upscaling of main.py
+    # preproc_workers: number of processes running the preprocessing in parallel
+    if not path.exists('output'):
+        os.mkdir('output')
+    lane_detector = LaneDetection(frame=None, prepoc=Preproc(mode=0), featext=FeatExtract(), visualizer=Visualizer())
+    stage_pipeline = StagePipeline(lane_detector, preproc_workers=2)
+    records, report = stage_pipeline.run('example_material\\example_video.mp4', path.join('output', 'detected_lanes_stages.avi'))
+    print(f"Processed {len(records)} frames at {report['fps']:.1f} FPS")
+    for name, stats in report['stages'].items():
+        print(f"{name}: {stats}")
+
+
+if __name__ == "__main__":
+    main()
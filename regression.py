@@ -0,0 +1,295 @@
+from frame import FrameDB
+from preproc import Preproc
+from visualizer import Visualizer
+from feat_ext import FeatExtract
+from main import LaneDetection
+import cv2 as cv
+import numpy as np
+import argparse
+import time
+
+
+def make_synthetic_clip(nframes: int = 60, yellow: bool = False, size: tuple[int, int] = (1280, 720), SHIFT_AMPLITUDE: int = 100, LANE_WIDTH: int = 8) -> list[np.ndarray]:
+    """Generates a synthetic road clip with two straight lanes swaying sideways.
+
+    Args:
+        nframes (int, optional): Number of frames to generate. Defaults to 60.
+        yellow (bool, optional): Draws yellow lanes instead of white ones. (True = yellow)
+        size (tuple[int, int], optional): Resolution of the frames ([width,height]). Defaults to (1280, 720).
+        SHIFT_AMPLITUDE (int, optional): Maximal horizontal shift of the lanes in the downscaled (640x480) frame [pixel]. Defaults to 100.
+        LANE_WIDTH (int, optional): Width of the lanes in the downscaled (640x480) frame [pixel]. Defaults to 8.
+
+    Returns:
+        frames (list[np.ndarray]): Generated BGR frames.
+    """
+    width, height = size
+    scale_x = width / 640
+    scale_y = height / 480
+    color = (0, 210, 255) if yellow else (255, 255, 255)
+    frames = []
+    for i in range(nframes):
+        # Grey road with a bluish sky above the horizon
+        frame = np.full((height, width, 3), 70, np.uint8)
+        frame[:int(250*scale_y)] = (180, 140, 100)
+        shift = SHIFT_AMPLITUDE * np.sin(2*np.pi*i/nframes)
+        # Lanes are drawn through the points the perspective transform is based on, shifted by the current sway
+        for x_lower, x_upper in ((120, 245), (520, 395)):
+            lower = (int((x_lower+shift)*scale_x), height-1)
+            upper = (int((x_upper+shift*0.4)*scale_x), int(290*scale_y))
+            cv.line(frame, lower, upper, color, max(1, int(LANE_WIDTH*scale_x)))
+        frames.append(frame)
+    return frames
+
+
+def load_clip(import_path: str, max_frames: int = 0) -> list[np.ndarray]:
+    """Reads every frame of a recorded video file into memory.
+
+    Args:
+        import_path (str): Location of the video file.
+        max_frames (int, optional): Maximal number of frames to read, 0 means the whole clip. Defaults to 0.
+
+    Returns:
+        frames (list[np.ndarray]): Imported frames.
+    """
+    frame_db = FrameDB(import_path)
+    frames = []
+    while frame_db.streaming:
+        streaming, base = frame_db.import_frame()
+        if base is None or (max_frames and len(frames) >= max_frames):
+            break
+        frames.append(base)
+    frame_db.cap.release()
+    return frames
+
+
+def throughput(end_times: list[float], WARMUP_FRAMES: int = 5) -> float:
+    """Computes the throughput from the time stamps at which the frames were finished.
+    The span starts at the end of the warm-up frames, so start-up costs are left out.
+
+    Args:
+        end_times (list[float]): Time stamps of finishing the frames in order [s].
+        WARMUP_FRAMES (int, optional): Number of first frames left out of the throughput. Defaults to 5.
+
+    Returns:
+        fps (float): Frames finished after the warm-up divided by the elapsed time [frames/s].
+    """
+    start = WARMUP_FRAMES if len(end_times) > WARMUP_FRAMES + 1 else 0
+    elapsed = end_times[-1] - end_times[start] if end_times else 0
+    return (len(end_times) - 1 - start) / elapsed if elapsed > 0 else 0
+
+
+class GoldenTrace:
+    """Class for recording the per-frame output of the lane detection and checking candidate configurations against it."""
+
+    def __init__(self, left_poly: np.ndarray = None, right_poly: np.ndarray = None, direction: np.ndarray = None, sides_ok: np.ndarray = None, yellow_lanes: np.ndarray = None, fps: float = 0) -> None:
+        """Initializing the trace and the tolerances of the comparison.
+
+        Args:
+            left_poly (np.ndarray, optional): Polynomial coefficients of the left lane for every frame. (nframes, 2)
+            right_poly (np.ndarray, optional): Polynomial coefficients of the right lane for every frame. (nframes, 2)
+            direction (np.ndarray, optional): Direction of the vehicle for every frame. (nframes,)
+            sides_ok (np.ndarray, optional): Adequacy of the windows on both sides for every frame. (nframes, 2)
+            yellow_lanes (np.ndarray, optional): Yellow lanes flag for every frame. (nframes,)
+            fps (float, optional): End-to-end throughput of the reference pipeline (lane detection and text writing) [frames/s]. Defaults to 0.
+        """
+        self.left_poly = np.zeros((0, 2)) if left_poly is None else np.asarray(left_poly, np.float64)
+        self.right_poly = np.zeros((0, 2)) if right_poly is None else np.asarray(right_poly, np.float64)
+        self.direction = np.zeros(0, np.int32) if direction is None else np.asarray(direction, np.int32)
+        self.sides_ok = np.zeros((0, 2), bool) if sides_ok is None else np.asarray(sides_ok, bool)
+        self.yellow_lanes = np.zeros(0, bool) if yellow_lanes is None else np.asarray(yellow_lanes, bool)
+        self.fps = fps
+
+        # Tolerances of the comparison
+        # Maximal absolute deviation of the slope and of the intercept [pixel] of the fitted lines
+        self.SLOPE_TOL = 0.02
+        self.INTERCEPT_TOL = 5
+        # Maximal proportion of frames with a different direction, sides_ok or yellow lanes flag
+        self.DIRECTION_MISMATCH_TOL = 0.02
+        self.SIDES_OK_MISMATCH_TOL = 0.02
+        self.YELLOW_MISMATCH_TOL = 0.02
+        # Maximal relative drop of the throughput compared to the reference
+        self.FPS_DROP_TOL = 0.2
+
+    def __len__(self) -> int:
+        return len(self.direction)
+
+    @staticmethod
+    def trace(lane_detector: LaneDetection, frames: list[np.ndarray], WARMUP_FRAMES: int = 5) -> "GoldenTrace":
+        """Runs the lane detection and the text writing on the given frames and records the per-frame output and the throughput.
+        The throughput is measured over the same span as the one of StagePipeline.run.
+
+        Args:
+            lane_detector (LaneDetection): Freshly initialized lane detector to run, its state carries over between frames.
+            frames (list[np.ndarray]): Input frames.
+            WARMUP_FRAMES (int, optional): Number of first frames left out of the throughput (warm-up). Defaults to 5.
+
+        Returns:
+            trace (GoldenTrace): Recorded per-frame output.
+        """
+        left_poly, right_poly, direction, sides_ok, yellow_lanes, end_times = [], [], [], [], [], []
+        for imp_frame in frames:
+            frame_direction, original = lane_detector.process_frame(imp_frame)
+            lane_detector.visualizer.write_text(original, frame_direction, lane_detector.yellow_lanes_flag, 0)
+            end_times.append(time.perf_counter())
+
+            left_poly.append(np.array(lane_detector.left_poly, np.float64)[:2])
+            right_poly.append(np.array(lane_detector.right_poly, np.float64)[:2])
+            direction.append(frame_direction)
+            sides_ok.append(list(lane_detector.sides_ok))
+            yellow_lanes.append(lane_detector.yellow_lanes_flag)
+        return GoldenTrace(np.reshape(left_poly, (-1, 2)), np.reshape(right_poly, (-1, 2)), direction, np.reshape(sides_ok, (-1, 2)), yellow_lanes,
+                           throughput(end_times, WARMUP_FRAMES))
+
+    @staticmethod
+    def from_records(records: list[tuple], fps: float) -> "GoldenTrace":
+        """Builds a trace from the per-frame outputs of the stage pipeline.
+
+        Args:
+            records (list[tuple]): Per-frame outputs returned by StagePipeline.run.
+            fps (float): Throughput of the stage pipeline [frames/s].
+
+        Returns:
+            trace (GoldenTrace): Trace of the stage pipeline.
+        """
+        left_poly = [np.array(record[1], np.float64)[:2] for record in records]
+        right_poly = [np.array(record[2], np.float64)[:2] for record in records]
+        return GoldenTrace(np.reshape(left_poly, (-1, 2)), np.reshape(right_poly, (-1, 2)), [record[3] for record in records],
+                           np.reshape([list(record[4]) for record in records], (-1, 2)), [record[5] for record in records], fps)
+
+    def save(self, export_path: str) -> None:
+        """Saves the trace into a compressed numpy archive.
+
+        Args:
+            export_path (str): Location of the archive (.npz).
+        """
+        np.savez_compressed(export_path, left_poly=self.left_poly, right_poly=self.right_poly, direction=self.direction,
+                            sides_ok=self.sides_ok, yellow_lanes=self.yellow_lanes, fps=self.fps)
+
+    @staticmethod
+    def load(import_path: str) -> "GoldenTrace":
+        """Loads a trace saved with the save method.
+
+        Args:
+            import_path (str): Location of the archive (.npz).
+
+        Returns:
+            trace (GoldenTrace): Loaded trace.
+        """
+        with np.load(import_path) as archive:
+            return GoldenTrace(archive['left_poly'], archive['right_poly'], archive['direction'],
+                               archive['sides_ok'], archive['yellow_lanes'], float(archive['fps']))
+
+    def compare(self, candidate: "GoldenTrace") -> dict:
+        """Compares a candidate trace to this (golden) trace.
+
+        Args:
+            candidate (GoldenTrace): Trace of the candidate configuration recorded on the same frames.
+
+        Returns:
+            report (dict): Throughput and deviation metrics, the list of failed checks and the overall result. (passed = True means no regression)
+        """
+        if len(candidate) != len(self):
+            return {'passed': False, 'failures': [f'frame count {len(candidate)} != {len(self)}']}
+
+        poly_dev = np.abs(np.concatenate((candidate.left_poly - self.left_poly, candidate.right_poly - self.right_poly), axis=1))
+        report = {
+            'frames': len(self),
+            'fps': candidate.fps,
+            'reference_fps': self.fps,
+            'speedup': candidate.fps / self.fps if self.fps else 0,
+            'max_slope_dev': float(poly_dev[:, 0::2].max(initial=0)),
+            'max_intercept_dev': float(poly_dev[:, 1::2].max(initial=0)),
+            'direction_mismatch': float(np.mean(candidate.direction != self.direction)) if len(self) else 0,
+            'sides_ok_mismatch': float(np.mean(np.any(candidate.sides_ok != self.sides_ok, axis=1))) if len(self) else 0,
+            'yellow_mismatch': float(np.mean(candidate.yellow_lanes != self.yellow_lanes)) if len(self) else 0,
+        }
+
+        failures = []
+        if self.fps and candidate.fps < self.fps * (1 - self.FPS_DROP_TOL):
+            failures.append(f"fps {candidate.fps:.1f} < {self.fps * (1 - self.FPS_DROP_TOL):.1f}")
+        for key, tolerance in (('max_slope_dev', self.SLOPE_TOL), ('max_intercept_dev', self.INTERCEPT_TOL),
+                               ('direction_mismatch', self.DIRECTION_MISMATCH_TOL), ('sides_ok_mismatch', self.SIDES_OK_MISMATCH_TOL),
+                               ('yellow_mismatch', self.YELLOW_MISMATCH_TOL)):
+            if report[key] > tolerance:
+                failures.append(f"{key} {report[key]:.3f} > {tolerance}")
+        report['failures'] = failures
+        report['passed'] = not failures
+        return report
+
+    def replay(self, lane_detector: LaneDetection, frames: list[np.ndarray]) -> dict:
+        """Runs a candidate lane detector on the frames the trace was recorded on and compares the results.
+
+        Args:
+            lane_detector (LaneDetection): Freshly initialized candidate lane detector.
+            frames (list[np.ndarray]): Input frames the golden trace was recorded on.
+
+        Returns:
+            report (dict): See the compare method, extended with the proportion of skipped yellow lane passes.
+        """
+        report = self.compare(GoldenTrace.trace(lane_detector, frames))
+        report['yellow_skip_ratio'] = lane_detector.yellow_skip_ratio()
+        return report
+
+    def replay_stages(self, stage_pipeline: "StagePipeline", frames: list[np.ndarray]) -> dict:
+        """Runs the stage pipeline on the frames the trace was recorded on and compares the results.
+
+        Args:
+            stage_pipeline (StagePipeline): Candidate stage pipeline.
+            frames (list[np.ndarray]): Input frames the golden trace was recorded on.
+
+        Returns:
+            report (dict): See the compare method, extended with the statistics of the stages.
+        """
+        records, stage_report = stage_pipeline.run(frames)
+        report = self.compare(GoldenTrace.from_records(records, stage_report['fps']))
+        report['stages'] = stage_report['stages']
+        return report
+
+
+def main():
+    # Recording a golden trace with the reference pipeline: python regression.py record trace.npz --clip video.mp4
+    # Checking the current pipeline against it: python regression.py replay trace.npz --clip video.mp4
+    # Without --clip a synthetic clip is used (--yellow for yellow lanes). The replay exits with 1 on regression.
+    # --adaptive-yellow replays the pipeline with the adaptive yellow lane pass scheduling.
+    # --stages N replays the stage pipeline with N preprocessing processes (without the adaptive yellow lane pass scheduling).
+    parser = argparse.ArgumentParser(description="Golden-trace regression harness for the lane detection.")
+    parser.add_argument('action', choices=['record', 'replay'])
+    parser.add_argument('trace_path')
+    parser.add_argument('--clip', default='')
+    parser.add_argument('--max-frames', type=int, default=0)
+    parser.add_argument('--yellow', action='store_true')
+    parser.add_argument('--adaptive-yellow', action='store_true')
+    parser.add_argument('--stages', type=int, default=0)
+    args = parser.parse_args()
+    # The stage pipeline doesn't apply the adaptive yellow lane pass scheduling
+    if args.stages and args.adaptive_yellow:
+        parser.error("--stages can't be combined with --adaptive-yellow")
+    if args.stages < 0:
+        parser.error("--stages must be at least 1 (0 replays the sequential pipeline)")
+    # The golden trace always comes from the reference pipeline
+    if args.action == 'record' and (args.stages or args.adaptive_yellow):
+        parser.error("record uses the reference pipeline, --stages and --adaptive-yellow are only for replay")
+
+    frames = load_clip(args.clip, args.max_frames) if args.clip else make_synthetic_clip(args.max_frames or 60, args.yellow)
+    lane_detector = LaneDetection(frame=None, prepoc=Preproc(mode=0), featext=FeatExtract(), visualizer=Visualizer(), adaptive_yellow=args.adaptive_yellow)
+
+    if args.action == 'record':
+        golden = GoldenTrace.trace(lane_detector, frames)
+        golden.save(args.trace_path)
+        print(f"Recorded {len(golden)} frames at {golden.fps:.1f} FPS into {args.trace_path}")
+        return
+
+    golden = GoldenTrace.load(args.trace_path)
+    if args.stages:
+        # Imported here so the harness doesn't depend on the multiprocessing module otherwise
+        from pipeline import StagePipeline
+        report = golden.replay_stages(StagePipeline(lane_detector, preproc_workers=args.stages), frames)
+    else:
+        report = golden.replay(lane_detector, frames)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    raise SystemExit(0 if report['passed'] else 1)
+
+
+if __name__ == "__main__":
+    main()
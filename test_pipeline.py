@@ -0,0 +1,101 @@
+import os
+import tempfile
+import unittest
+import multiprocessing as mp
+import numpy as np
+import cv2 as cv
+from pipeline import FrameRing, StagePipeline
+from regression import GoldenTrace, make_synthetic_clip
+from test_regression import new_detector
+
+
+class FrameRingSlots(unittest.TestCase):
+    def testSlotLayout(self):
+        frame_ring = FrameRing(mp.get_context(), 4, [((2, 3), np.uint8), ((5,), np.float64)])
+        try:
+            image, values = frame_ring.slot(1)
+            image[:] = 7
+            values[:] = 0.5
+            # Frame indices one ring length apart share the same slot
+            image_wrapped, values_wrapped = frame_ring.slot(5)
+            self.assertTrue((image_wrapped == 7).all())
+            self.assertTrue((values_wrapped == 0.5).all())
+            self.assertFalse(np.shares_memory(frame_ring.slot(2)[0], image))
+        finally:
+            frame_ring.close(unlink=True)
+        "Unit test for the shared memory layout of the ring slots"
+
+    def testBackpressure(self):
+        frame_ring = FrameRing(mp.get_context(), 2, [((1,), np.uint8)])
+        try:
+            self.assertEqual(frame_ring.acquire(0), 1)
+            self.assertEqual(frame_ring.acquire(1), 2)
+            # The slot of frame 2 is only free after frame 0 is released
+            self.assertFalse(frame_ring.free[0].acquire(block=False))
+            frame_ring.release(0)
+            self.assertEqual(frame_ring.acquire(2), 2)
+        finally:
+            frame_ring.close(unlink=True)
+        "Unit test for the slot handoff of the ring"
+
+
+class StagePipelineOutput(unittest.TestCase):
+    def setUp(self):
+        self.frames = make_synthetic_clip(20) + make_synthetic_clip(20, yellow=True)
+        self.golden = GoldenTrace.trace(new_detector(), self.frames)
+        self.golden.FPS_DROP_TOL = 1
+
+    def testMatchesGoldenTrace(self):
+        for preproc_workers in (1, 2):
+            report = self.golden.replay_stages(StagePipeline(new_detector(), preproc_workers), self.frames)
+            self.assertTrue(report['passed'], report['failures'])
+            self.assertEqual(report['max_intercept_dev'], 0)
+            self.assertEqual(report['direction_mismatch'], 0)
+            self.assertEqual(len(report['stages']), 3 + preproc_workers)
+        "Unit test for the stage pipeline giving the same outputs as the reference pipeline"
+
+    def testOrderAndOutputVideo(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, 'detected_lanes.avi')
+            records, report = StagePipeline(new_detector(), preproc_workers=3).run(self.frames, output_path)
+            self.assertTrue(os.path.getsize(output_path) > 0)
+        self.assertEqual([record[0] for record in records], list(range(len(self.frames))))
+        self.assertEqual(sum(report['stages'][f'preproc_{worker}']['frames'] for worker in range(3)), len(self.frames))
+        for stats in report['stages'].values():
+            self.assertTrue(0 <= stats['occupancy'] <= 1)
+        "Unit test for keeping the frame order with multiple preprocessing processes"
+
+    def testVideoSource(self):
+        with tempfile.TemporaryDirectory() as directory:
+            clip_path = os.path.join(directory, 'clip.avi')
+            height, width = self.frames[0].shape[:2]
+            writer = cv.VideoWriter(clip_path, cv.VideoWriter_fourcc(*'XVID'), 24.0, (width, height))
+            for frame in self.frames:
+                writer.write(frame)
+            writer.release()
+            records, report = StagePipeline(new_detector(), preproc_workers=2).run(clip_path)
+        self.assertEqual([record[0] for record in records], list(range(len(self.frames))))
+        self.assertEqual(report['stages']['decode']['frames'], len(self.frames))
+        "Unit test for decoding a video file in a separate stage process"
+
+    def testSmallRings(self):
+        stage_pipeline = StagePipeline(new_detector(), preproc_workers=3)
+        stage_pipeline.NSLOTS = 2
+        records, report = stage_pipeline.run(self.frames)
+        self.assertEqual([record[0] for record in records], list(range(len(self.frames))))
+        "Unit test for the slot handoff with more preprocessing processes than ring slots"
+
+    def testRejectsAdaptiveYellow(self):
+        with self.assertRaises(ValueError):
+            StagePipeline(new_detector(adaptive_yellow=True))
+        "Unit test for rejecting the adaptive yellow lane pass scheduling in the stage pipeline"
+
+    def testRejectsNoPreprocWorkers(self):
+        for preproc_workers in (0, -1):
+            with self.assertRaises(ValueError):
+                StagePipeline(new_detector(), preproc_workers)
+        "Unit test for rejecting a stage pipeline without preprocessing processes"
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from preproc import Preproc
+from feat_ext import FeatExtract
+from visualizer import Visualizer
+from main import LaneDetection
+from regression import GoldenTrace, make_synthetic_clip
+
+
+def new_detector(adaptive_yellow: bool = False) -> LaneDetection:
+    return LaneDetection(frame=None, prepoc=Preproc(mode=0), featext=FeatExtract(), visualizer=Visualizer(), adaptive_yellow=adaptive_yellow)
+
+
+class GoldenTraceRegression(unittest.TestCase):
+    def setUp(self):
+        self.frames = make_synthetic_clip(30) + make_synthetic_clip(30, yellow=True)
+        self.golden = GoldenTrace.trace(new_detector(), self.frames)
+
+    def testTraceContents(self):
+        self.assertEqual(len(self.golden), 60)
+        self.assertEqual(self.golden.left_poly.shape, (60, 2))
+        self.assertGreater(self.golden.fps, 0)
+        # The white half of the clip is followed as combined lanes, the yellow lanes are picked up from their first frame
+        self.assertFalse(self.golden.yellow_lanes[:30].any())
+        self.assertTrue(self.golden.yellow_lanes[30])
+        "Unit test for recording the golden trace on synthetic white and yellow clips"
+
+    def testReplaySameConfiguration(self):
+        self.golden.FPS_DROP_TOL = 1
+        report = self.golden.replay(new_detector(), self.frames)
+        self.assertTrue(report['passed'], report['failures'])
+        self.assertEqual(report['max_intercept_dev'], 0)
+        "Unit test for replaying the reference configuration against its own trace"
+
+    def testSaveLoad(self):
+        with tempfile.TemporaryDirectory() as directory:
+            trace_path = os.path.join(directory, 'trace.npz')
+            self.golden.save(trace_path)
+            loaded = GoldenTrace.load(trace_path)
+        np.testing.assert_array_equal(loaded.right_poly, self.golden.right_poly)
+        np.testing.assert_array_equal(loaded.sides_ok, self.golden.sides_ok)
+        self.assertEqual(loaded.fps, self.golden.fps)
+        "Unit test for saving and loading the golden trace"
+
+    def testOutputDrift(self):
+        self.golden.FPS_DROP_TOL = 1
+        lane_detector = new_detector()
+        lane_detector.WINDOW_HOR_OFFSET = 5
+        report = self.golden.replay(lane_detector, self.frames)
+        self.assertFalse(report['passed'])
+        "Unit test for detecting deviating outputs of a candidate configuration"
+
+    def testThroughputRegression(self):
+        self.golden.fps *= 1000
+        report = self.golden.replay(new_detector(), self.frames)
+        self.assertFalse(report['passed'])
+        self.assertTrue(report['failures'][0].startswith('fps'))
+        "Unit test for detecting a throughput regression"
+
+
+class AdaptiveYellowScheduling(unittest.TestCase):
+    def testSkipsWithoutYellow(self):
+        frames = make_synthetic_clip(40)
+        golden = GoldenTrace.trace(new_detector(), frames)
+        golden.FPS_DROP_TOL = 1
+        lane_detector = new_detector(adaptive_yellow=True)
+        report = golden.replay(lane_detector, frames)
+        self.assertTrue(report['passed'], report['failures'])
+        # Only every YELLOW_CHECK_PERIOD-th frame runs the yellow pass
+        self.assertEqual(lane_detector.yellow_pass_runs, 4)
+        self.assertAlmostEqual(report['yellow_skip_ratio'], 0.9)
+        "Unit test for skipping the yellow pass on a clip without yellow lanes"
+
+    def testRunsWithYellow(self):
+        frames = make_synthetic_clip(40, yellow=True)
+        golden = GoldenTrace.trace(new_detector(), frames)
+        golden.FPS_DROP_TOL = 1
+        lane_detector = new_detector(adaptive_yellow=True)
+        report = golden.replay(lane_detector, frames)
+        self.assertTrue(report['passed'], report['failures'])
+        self.assertEqual(report['yellow_skip_ratio'], 0)
+        "Unit test for running the yellow pass on every frame of a clip with yellow lanes"
+
+    def testHysteresis(self):
+        lane_detector = new_detector(adaptive_yellow=True)
+        lane_detector.YELLOW_CHECK_PERIOD = 1000
+
+        def yellow_frame(npixels):
+            frame = np.zeros((230, 640, 3), np.uint8)
+            frame.reshape(-1, 3)[:npixels] = (0, 210, 255)
+            return frame
+
+        between = (lane_detector.YELLOW_PIXELS_ON + lane_detector.YELLOW_PIXELS_OFF) // 2
+        # The first frame is always checked, the count in between the limits doesn't open the gate
+        self.assertTrue(lane_detector.schedule_yellow_pass(yellow_frame(between)))
+        self.assertFalse(lane_detector.schedule_yellow_pass(yellow_frame(between)))
+        self.assertTrue(lane_detector.schedule_yellow_pass(yellow_frame(lane_detector.YELLOW_PIXELS_ON)))
+        # Once open, the gate stays open until the count drops below the lower limit
+        self.assertTrue(lane_detector.schedule_yellow_pass(yellow_frame(between)))
+        self.assertFalse(lane_detector.schedule_yellow_pass(yellow_frame(lane_detector.YELLOW_PIXELS_OFF - 1)))
+        self.assertEqual(lane_detector.yellow_pass_skips, 2)
+        "Unit test for the hysteresis of the yellow pass scheduling"
+
+    def testFoundLanesKeepGateOpen(self):
+        # Thin yellow lanes with a pixel count between YELLOW_PIXELS_OFF and YELLOW_PIXELS_ON
+        frames = make_synthetic_clip(40, yellow=True, size=(640, 480), SHIFT_AMPLITUDE=20, LANE_WIDTH=1)
+        golden = GoldenTrace.trace(new_detector(), frames)
+        golden.FPS_DROP_TOL = 1
+        self.assertTrue(golden.yellow_lanes.all())
+        lane_detector = new_detector(adaptive_yellow=True)
+        report = golden.replay(lane_detector, frames)
+        self.assertTrue(report['passed'], report['failures'])
+        self.assertEqual(report['yellow_mismatch'], 0)
+        "Unit test for keeping the yellow pass running while it finds the lanes below the opening pixel count"
+
+
+if __name__ == '__main__':
+    unittest.main()